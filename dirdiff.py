@@ -14,25 +14,45 @@ Functions:
 
 import os
 import stat
-from itertools import filterfalse
+import mmap
+import errno
+import hashlib
+import functools
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import datetime
 
+try:
+    import _dirdiff_c      # optional C accelerator, see setup.py
+except ImportError:
+    _dirdiff_c = None
+
 __all__ = ['clear_cache', 'cmp', 'dircmp', 'cmpfiles', 'DEFAULT_IGNORES']
 
-_cache = {}
-BUFSIZE = 8*1024
+BUFSIZE = 256*1024
+
+# Per-comparison trace output; off by default because the prints cost
+# more than the comparisons on large trees.
+_VERBOSE = False
 
 DEFAULT_IGNORES = [
     'RCS', 'CVS', 'tags', '.git', '.hg', '.bzr', '_darcs', '__pycache__']
 
+# On POSIX os.path.normcase is the identity; detect that once so phase1
+# can skip the per-name call (and its string allocation on Windows).
+_NORMCASE_IS_NOOP = os.path.normcase('Aa') == 'Aa'
+
+_HAS_DIR_FD = os.stat in os.supports_dir_fd
+
 def to_file(list, file):
-    for item in list:
-        file.write('\t' + item + '\n')
+    file.writelines(f'\t{item}\n' for item in list)
     file.write('\n\n')
     
 def clear_cache():
     """Clear the filecmp cache."""
-    _cache.clear()
+    _cached_digest.cache_clear()
+    _seen.clear()
 
 def cmp(f1, f2, shallow=True):
     """Compare two files.
@@ -50,52 +70,185 @@ def cmp(f1, f2, shallow=True):
 
     True if the files are the same, False otherwise.
 
-    This function uses a cache for past comparisons and the results,
-    with cache entries invalidated if their stat information
-    changes.  The cache may be cleared by calling clear_cache().
+    Files seen in only one deep comparison are compared directly, which
+    stops at the first differing byte.  A file that keeps coming back
+    (compared against many siblings) is digested once and cached keyed
+    on its identity and stat information, so further comparisons are
+    O(1) digest checks.  Stale entries drop out when the stat
+    information changes.  The cache may be cleared by calling
+    clear_cache().
 
     """
-    s1 = _sig(os.stat(f1))
-    s2 = _sig(os.stat(f2))
-    print('Decide:')
-    print(f1)
-    print(f2)
+    st1 = os.stat(f1)
+    st2 = os.stat(f2)
+    s1 = _sig(st1)
+    s2 = _sig(st2)
+    if _VERBOSE:
+        print('Decide:')
+        print(f1)
+        print(f2)
     if s1[0] != stat.S_IFREG or s2[0] != stat.S_IFREG:
         return False
-    if shallow and _is_similar(os.stat(f1).st_size, os.stat(f2).st_size):
+    if shallow and _is_similar(st1.st_size, st2.st_size):
         return True
     if s1[1] != s2[1]:
         return False
 
-    outcome = _cache.get((f1, f2, s1, s2))
-    if outcome is None:
-        outcome = _do_cmp(f1, f2)
-        if len(_cache) > 100:      # limit the maximum size of the cache
-            clear_cache()
-        _cache[f1, f2, s1, s2] = outcome
-    return outcome
+    return _deep_cmp(f1, st1, f2, st2)
+
+# Identities of files that already took part in a deep comparison.  A
+# repeat appearance means the file is being compared against several
+# others, so paying for a full-content digest amortizes; a one-shot
+# pair is cheaper via _do_cmp, which stops at the first difference.
+_seen = {}
+
+def _deep_cmp(f1, st1, f2, st2):
+    k1 = (st1.st_dev, st1.st_ino, st1.st_mtime_ns, st1.st_size)
+    k2 = (st2.st_dev, st2.st_ino, st2.st_mtime_ns, st2.st_size)
+    # Either side returning is enough: the repeat visitor's digest is
+    # cached (or computed once now), so only the fresh partner is read.
+    repeat = k1 in _seen or k2 in _seen
+    if len(_seen) > 512:       # limit the maximum size of the cache
+        _seen.clear()
+    _seen[k1] = _seen[k2] = True
+    if repeat:
+        return _digest(f1, st1) == _digest(f2, st2)
+    return _do_cmp(f1, f2)
 
 def _sig(st):
     return (stat.S_IFMT(st.st_mode),
             st.st_size,
             st.st_mtime)
 
+def _digest(path, st):
+    # Content digest memoized on the file's identity and stat info, so
+    # the same content compared against N siblings is only read once.
+    return _cached_digest(path, st.st_dev, st.st_ino,
+                          st.st_mtime_ns, st.st_size)
+
+@functools.lru_cache(maxsize=128)
+def _cached_digest(path, dev, ino, mtime_ns, size):
+    with open(path, 'rb', buffering=BUFSIZE) as fp:
+        if hasattr(hashlib, 'file_digest'):    # 3.11+
+            return hashlib.file_digest(fp, 'blake2b').digest()
+        h = hashlib.blake2b()
+        while chunk := fp.read(BUFSIZE):
+            h.update(chunk)
+        return h.digest()
+
 def _is_similar(s1, s2):
-    print('Sizes: ', s1, ' byte and ', s2, ' byte')
-    print('Difference: ', (100 - s1/s2*100),' %', 'same? ', (s1/s2 >= 0.8) and (s1/s2 <= 1.25))
-    return (s1/s2 >= 0.8) and (s1/s2 <= 1.25) # +-20%
+    if s1 == 0 or s2 == 0:
+        similar = s1 == s2
+    else:
+        lo, hi = (s1, s2) if s1 <= s2 else (s2, s1)
+        similar = 5*lo >= 4*hi  # min/max >= 0.8, i.e. ratio within +-20%
+    if _VERBOSE:
+        print('Sizes: ', s1, ' byte and ', s2, ' byte')
+        print('Similar (within 20%)? ', similar)
+    return similar
 			
+MMAP_CHUNK = 1024*1024
+
+_HAS_FADVISE = hasattr(os, 'posix_fadvise')
+
+def _fadvise(fd, advice):
+    # Hint the kernel; advice is best-effort, so ignore refusals.
+    try:
+        os.posix_fadvise(fd, 0, 0, advice)
+    except OSError:
+        pass
+
 def _do_cmp(f1, f2):
-    bufsize = BUFSIZE
-    with open(f1, 'rb') as fp1, open(f2, 'rb') as fp2:
+    if _dirdiff_c is not None:
+        try:
+            return _dirdiff_c.cmp_files(f1, f2)
+        except OSError as err:
+            # mmap is refused on some mounts (FUSE/network -> ENODEV,
+            # EINVAL); the Python path below has a read-loop fallback
+            # for exactly that, so don't let it surface as "funny".
+            if err.errno not in (errno.ENODEV, errno.EINVAL):
+                raise
+    with open(f1, 'rb', buffering=BUFSIZE) as fp1, \
+         open(f2, 'rb', buffering=BUFSIZE) as fp2:
+        size1 = os.fstat(fp1.fileno()).st_size
+        size2 = os.fstat(fp2.fileno()).st_size
+        if size1 != size2:
+            return False
+        if size1 == 0:
+            return True
+        if _HAS_FADVISE:
+            _fadvise(fp1.fileno(), os.POSIX_FADV_SEQUENTIAL)
+            _fadvise(fp2.fileno(), os.POSIX_FADV_SEQUENTIAL)
+        try:
+            try:
+                mm1 = mmap.mmap(fp1.fileno(), 0, access=mmap.ACCESS_READ)
+                mm2 = mmap.mmap(fp2.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                return _do_cmp_buffered(fp1, fp2)
+            with mm1, mm2:
+                if not _probe_equal(mm1, mm2, size1):
+                    return False
+                # Slice-wise == dispatches to C memcmp, no Python byte loop
+                for i in range(0, size1, MMAP_CHUNK):
+                    if mm1[i:i+MMAP_CHUNK] != mm2[i:i+MMAP_CHUNK]:
+                        return False
+                return True
+        finally:
+            # Each file is read once; don't let it pollute the page cache.
+            if _HAS_FADVISE:
+                _fadvise(fp1.fileno(), os.POSIX_FADV_DONTNEED)
+                _fadvise(fp2.fileno(), os.POSIX_FADV_DONTNEED)
+
+def _probe_equal(mm1, mm2, size, k=64):
+    # Sample k strided 16-byte windows before the full scan: any
+    # mismatching probe proves the files differ without reading either
+    # file in full.  Each probe compare is a single C-level memcmp.
+    if size <= 16*k:
+        return True    # too small for sampling to save anything
+    for i in range(k):
+        off = (i*size // k) & ~15
+        if mm1[off:off+16] != mm2[off:off+16]:
+            return False
+    return True
+
+_read_pool = None
+
+def _get_read_pool():
+    # Created on first use so importing the module does not spawn threads.
+    global _read_pool
+    if _read_pool is None:
+        _read_pool = ThreadPoolExecutor(max_workers=2)
+    return _read_pool
+
+def _do_cmp_buffered(fp1, fp2):
+    # Anonymous mmaps are page-aligned, which keeps the kernel's
+    # copy_to_user on its aligned fast path; readinto avoids allocating
+    # a fresh bytes object per chunk.
+    pool = _get_read_pool()
+    with mmap.mmap(-1, BUFSIZE) as buf1, mmap.mmap(-1, BUFSIZE) as buf2:
         while True:
-            b1 = fp1.read(bufsize)
-            b2 = fp2.read(bufsize)
-            if b1 != b2:
+            # readinto releases the GIL, so the two reads overlap; on
+            # separate devices this hides one read's latency entirely.
+            fut1 = pool.submit(fp1.readinto, buf1)
+            fut2 = pool.submit(fp2.readinto, buf2)
+            n1 = fut1.result()
+            n2 = fut2.result()
+            if n1 != n2 or buf1[:n1] != buf2[:n2]:
                 return False
-            if not b1:
+            if not n1:
                 return True
 
+# Section templates for report_mod, formatted once per section instead
+# of concatenated piecewise per call.
+_HEADERS = dict(
+    banner='\nCOMPARISON OF FILES BETWEEN FOLDERS:\n\n{}\n and \n{}\n',
+    only_in='\nOnly in {}:\n',
+    same_files='\nSimilar files :\n',
+    diff_files='\nDiffering files :\n',
+    funny_files='\nTrouble with common files :\n',
+    common_dirs='\nCommon subdirectories :\n',
+    common_funny='\nCommon funny cases :\n')
+
 # Directory comparison class.
 #
 class dircmp:
@@ -143,39 +296,93 @@ class dircmp:
             self.ignore = DEFAULT_IGNORES
         else:
             self.ignore = ignore
+        self._skip = frozenset(self.hide + self.ignore)
 
     def phase0(self): # Compare everything except common subdirectories
-        self.left_list = _filter(os.listdir(self.left),
-                                 self.hide+self.ignore)
-        self.right_list = _filter(os.listdir(self.right),
-                                  self.hide+self.ignore)
+        # DirEntry objects cache stat results: on Windows the data comes
+        # free with the directory read; on POSIX the first .stat() still
+        # syscalls but repeated calls don't re-stat.
+        with os.scandir(self.left) as it:
+            self.left_entries = {entry.name: entry for entry in it}
+        with os.scandir(self.right) as it:
+            self.right_entries = {entry.name: entry for entry in it}
+        self.left_list = _filter(self.left_entries, self._skip)
+        self.right_list = _filter(self.right_entries, self._skip)
         self.left_list.sort()
         self.right_list.sort()
 
     def phase1(self): # Compute common names
-        a = dict(zip(map(os.path.normcase, self.left_list), self.left_list))
-        b = dict(zip(map(os.path.normcase, self.right_list), self.right_list))
-        self.common = list(map(a.__getitem__, filter(b.__contains__, a)))
-        self.left_only = list(map(a.__getitem__, filterfalse(b.__contains__, a)))
-        self.right_only = list(map(b.__getitem__, filterfalse(a.__contains__, b)))
+        # Sorted here once; the report methods rely on phase output
+        # being ordered instead of re-sorting per report.
+        if _NORMCASE_IS_NOOP:
+            # POSIX: normcase is the identity, use the names directly.
+            ak = set(self.left_list)
+            bk = set(self.right_list)
+            self.common = sorted(ak & bk)
+            self.left_only = sorted(ak - bk)
+            self.right_only = sorted(bk - ak)
+            return
+        a = {os.path.normcase(n): n for n in self.left_list}
+        b = {os.path.normcase(n): n for n in self.right_list}
+        ak = a.keys()
+        bk = b.keys()
+        # dict view set algebra runs in C -- one pass per result instead
+        # of a Python-level filter pipeline per list.
+        self.common = sorted(a[k] for k in ak & bk)
+        self.left_only = sorted(a[k] for k in ak - bk)
+        self.right_only = sorted(b[k] for k in bk - ak)
 
     def phase2(self): # Distinguish files, directories, funnies
         self.common_dirs = []
         self.common_files = []
         self.common_funny = []
 
+        # Where dir_fd is supported (POSIX), stat by bare name relative
+        # to a directory fd: the parent path is resolved once per side
+        # instead of once per entry.  Elsewhere the cached
+        # DirEntry.stat() from scandir is already the cheap option.
+        lfd = rfd = None
+        if _HAS_DIR_FD:
+            dirflags = os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0)
+            try:
+                lfd = os.open(self.left, dirflags)
+                rfd = os.open(self.right, dirflags)
+            except OSError:
+                if lfd is not None:
+                    os.close(lfd)
+                lfd = rfd = None
+        try:
+            self._phase2_classify(lfd, rfd)
+        finally:
+            if lfd is not None:
+                os.close(lfd)
+            if rfd is not None:
+                os.close(rfd)
+
+    def _phase2_classify(self, lfd, rfd):
         for x in self.common:
-            a_path = os.path.join(self.left, x)
-            b_path = os.path.join(self.right, x)
-
             ok = 1
             try:
-                a_stat = os.stat(a_path)
+                if lfd is not None:
+                    a_stat = os.stat(x, dir_fd=lfd)
+                else:
+                    a_entry = self.left_entries.get(x)
+                    if a_entry is not None:
+                        a_stat = a_entry.stat()   # cached by scandir
+                    else:
+                        a_stat = os.stat(os.path.join(self.left, x))
             except OSError as why:
                 # print('Can\'t stat', a_path, ':', why.args[1])
                 ok = 0
             try:
-                b_stat = os.stat(b_path)
+                if rfd is not None:
+                    b_stat = os.stat(x, dir_fd=rfd)
+                else:
+                    b_entry = self.right_entries.get(x)
+                    if b_entry is not None:
+                        b_stat = b_entry.stat()
+                    else:
+                        b_stat = os.stat(os.path.join(self.right, x))
             except OSError as why:
                 # print('Can\'t stat', b_path, ':', why.args[1])
                 ok = 0
@@ -195,6 +402,8 @@ class dircmp:
                 self.common_funny.append(x)
 
     def phase3(self): # Find out differences between common files
+        # common_files is sorted and cmpfiles keeps input order, so the
+        # three buckets come back sorted too.
         xx = cmpfiles(self.left, self.right, self.common_files)
         self.same_files, self.diff_files, self.funny_files = xx
 
@@ -208,67 +417,48 @@ class dircmp:
             b_x = os.path.join(self.right, x)
             self.subdirs[x]  = dircmp(a_x, b_x, self.ignore, self.hide)
 
-    def phase4_closure(self): # Recursively call phase4() on subdirectories
-        self.phase4()
-        for sd in self.subdirs.values():
-            sd.phase4_closure()
+    def phase4_closure(self): # Call phase4() on all subdirectories
+        # Iterative BFS: no recursion limit on deep trees, no Python
+        # frame per directory.
+        queue = deque([self])
+        while queue:
+            node = queue.popleft()
+            node.phase4()
+            queue.extend(node.subdirs.values())
 
     def report(self): # Print a report on the differences between a and b
         # Output format is purposely lousy
         print('diff', self.left, self.right)
         if self.left_only:
-            self.left_only.sort()
             print('Only in', self.left, ':', self.left_only)
         if self.right_only:
-            self.right_only.sort()
             print('Only in', self.right, ':', self.right_only)
         if self.same_files:
-            self.same_files.sort()
             print('Similar files :', self.same_files)
         if self.diff_files:
-            self.diff_files.sort()
             print('Differing files :', self.diff_files)
         if self.funny_files:
-            self.funny_files.sort()
             print('Trouble with common files :', self.funny_files)
         if self.common_dirs:
-            self.common_dirs.sort()
             print('Common subdirectories :', self.common_dirs)
         if self.common_funny:
-            self.common_funny.sort()
             print('Common funny cases :', self.common_funny)
             
     def report_mod(self, file):
-        file.write('\nCOMPARISON OF FILES BETWEEN FOLDERS:\n\n')
-        file.write(self.left + '\n and \n' + self.right + '\n')
-        if self.left_only:
-            self.left_only.sort()
-            file.write('\nOnly in '+ self.left + ':\n')
-            to_file(self.left_only, file)
-        if self.right_only:
-            self.right_only.sort()
-            file.write('\nOnly in '+ self.right + ':\n')
-            to_file(self.right_only, file)
-        if self.same_files:
-            self.same_files.sort()
-            file.write('\nSimilar files :\n')
-            to_file(self.same_files, file)
-        if self.diff_files:
-            self.diff_files.sort()
-            file.write('\nDiffering files :\n')
-            to_file(self.diff_files, file)
-        if self.funny_files:
-            self.funny_files.sort()
-            file.write('\nTrouble with common files :\n')
-            to_file(self.funny_files, file)
-        if self.common_dirs:
-            self.common_dirs.sort()
-            file.write('\nCommon subdirectories :\n')
-            to_file(self.common_dirs, file)
-        if self.common_funny:
-            self.common_funny.sort()
-            file.write('\nCommon funny cases :\n')
-            to_file(self.common_funny, file)
+        lines = [_HEADERS['banner'].format(self.left, self.right)]
+        for header, items in (
+                (_HEADERS['only_in'].format(self.left), self.left_only),
+                (_HEADERS['only_in'].format(self.right), self.right_only),
+                (_HEADERS['same_files'], self.same_files),
+                (_HEADERS['diff_files'], self.diff_files),
+                (_HEADERS['funny_files'], self.funny_files),
+                (_HEADERS['common_dirs'], self.common_dirs),
+                (_HEADERS['common_funny'], self.common_funny)):
+            if items:
+                lines.append(header)
+                lines.extend(f'\t{item}\n' for item in items)
+                lines.append('\n\n')
+        file.writelines(lines)
 	
     def report_partial_closure(self): # Print reports on self and on subdirs
         self.report()
@@ -276,17 +466,23 @@ class dircmp:
             print()
             sd.report()
 
-    def report_full_closure(self, file): # Report on self and subdirs recursively
-        self.report_mod(file)
-        for sd in self.subdirs.values():
-            print()
-            sd.report_full_closure(file)
+    def report_full_closure(self, file): # Report on self and all subdirs
+        # Depth-first with the deque as a stack, so each directory is
+        # followed by its own subtree as in the recursive version.
+        queue = deque([self])
+        while queue:
+            node = queue.popleft()
+            if node is not self:
+                print()
+            node.report_mod(file)
+            queue.extendleft(reversed(node.subdirs.values()))
 
     methodmap = dict(subdirs=phase4,
                      same_files=phase3, diff_files=phase3, funny_files=phase3,
                      common_dirs = phase2, common_files=phase2, common_funny=phase2,
                      common=phase1, left_only=phase1, right_only=phase1,
-                     left_list=phase0, right_list=phase0)
+                     left_list=phase0, right_list=phase0,
+                     left_entries=phase0, right_entries=phase0)
 
     def __getattr__(self, attr):
         if attr not in self.methodmap:
@@ -305,15 +501,58 @@ def cmpfiles(a, b, common, shallow=True):
       files that compare equal
       files that are different
       filenames that aren't regular files.
+    Each list keeps the order the names have in common.
 
     """
     res = ([], [], [])
+    if len(common) > 32 and _fork_available():
+        # Pair comparisons are independent and I/O bound -- spread them
+        # over the cores so several files stream concurrently.  Results
+        # arrive unordered; bucket them in input order afterwards.
+        pool = _get_cmp_pool()
+        pairs = ((a, b, x, shallow) for x in common)
+        outcome = dict(pool.imap_unordered(_cmp_pair, pairs, chunksize=16))
+        for x in common:
+            res[outcome[x]].append(x)
+        return res
     for x in common:
         ax = os.path.join(a, x)
         bx = os.path.join(b, x)
         res[_cmp(ax, bx, shallow)].append(x)
     return res
 
+def _fork_available():
+    # Spawn-based pools re-import the caller's __main__, which blows up
+    # in unguarded scripts; only parallelize where fork exists.
+    return 'fork' in multiprocessing.get_all_start_methods()
+
+_cmp_pool = None
+
+def _get_cmp_pool():
+    # One pool for the process lifetime; spawning a fresh pool per
+    # directory would cost more than the comparisons it parallelizes.
+    global _cmp_pool
+    if _cmp_pool is None:
+        ctx = multiprocessing.get_context('fork')
+        _cmp_pool = ctx.Pool(os.cpu_count())
+    return _cmp_pool
+
+def _reset_pools_after_fork():
+    # Pool threads and worker processes don't survive fork; a child
+    # submitting to an inherited executor would block forever.  Drop
+    # the singletons so children lazily build their own.
+    global _read_pool, _cmp_pool
+    _read_pool = None
+    _cmp_pool = None
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_pools_after_fork)
+
+# Worker for cmpfiles; top-level so it pickles for multiprocessing.
+def _cmp_pair(args):
+    a, b, x, shallow = args
+    return x, _cmp(os.path.join(a, x), os.path.join(b, x), shallow)
+
 
 # Compare two files.
 # Return:
@@ -329,9 +568,10 @@ def _cmp(a, b, sh, abs=abs, cmp=cmp):
 
 
 # Return a copy with items that occur in skip removed.
+# skip should be a set for O(1) membership tests.
 #
 def _filter(flist, skip):
-    return list(filterfalse(skip.__contains__, flist))
+    return [x for x in flist if x not in skip]
 
 		
 def output(filename):
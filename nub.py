@@ -1,15 +1,33 @@
 import xml.etree.ElementTree as etree
 import datetime
+import functools
+import os
 
 version="4.2"
 scriptname="nub"
 
-def parse(filename):
+def taxonomies(filename):
     file=filename+'.xml'
+    # keyed on mtime as well, so an edited file is re-parsed
+    return _taxonomies_cached(file, os.stat(file).st_mtime_ns)
+
+@functools.lru_cache(maxsize=8)
+def _taxonomies_cached(file, mtime_ns):
+    # iterparse with per-element clear() streams the document, so
+    # memory stays bounded by one <taxonomy> instead of the whole DOM.
     print('START Parsing ' +file)
-    tree = etree.parse(file)
+    records = []
+    for event, elem in etree.iterparse(file, events=('end',)):
+        if elem.tag == 'taxonomy':
+            xsd = elem.find('xsd')
+            zip = elem.find('zip')
+            records.append((elem.get('libelle'),
+                            xsd.get('dtdeb') if xsd is not None else None,
+                            xsd.get('dtfin') if xsd is not None else None,
+                            zip.text if zip is not None else None))
+            elem.clear()
     print('END Parsing ' +file)
-    return tree.getroot()
+    return records
 
 		
 def output(filename,funcname):
@@ -27,11 +45,8 @@ def v():
 # usage nub.dates('crd-q4')
 def dates(filename):
     f = output(filename,'dates')
-   
-    for taxonomy in parse(filename).findall('taxonomy'):
-        libelle = taxonomy.get('libelle')
-        dtdeb = taxonomy.find('xsd').get('dtdeb')
-        dtfin = taxonomy.find('xsd').get('dtfin')
+
+    for libelle, dtdeb, dtfin, zip in taxonomies(filename):
         f.write ('{:_<32} \tvalid from {} \tvalid to {}\n'.format(libelle, dtdeb, dtfin))
   
 # for å sammenligne hvilke taksonomier dekker eller ikke deker filer
@@ -42,9 +57,9 @@ def dates(filename):
 def diff(q2,q3,q4):
     f = output(q2+'-'+q3+'-'+q4,'diff')
    
-    l2 = set(t.get('libelle') for t in parse(q2).findall('taxonomy'))
-    l3 = set(t.get('libelle') for t in parse(q3).findall('taxonomy'))
-    l4 = set(t.get('libelle') for t in parse(q4).findall('taxonomy'))
+    l2 = set(t[0] for t in taxonomies(q2))
+    l3 = set(t[0] for t in taxonomies(q3))
+    l4 = set(t[0] for t in taxonomies(q4))
     f.write ('{:_<32} q2 q3 q4 \n'.format('taxonomy'))
     for l in sorted(l4 | l3 | l2):
         f.write ('{:_<32} {} {} {} \n'.format(l, ' x' if l in l2 else ' -', ' x' if l in l3 else ' -', ' x' if l in l4 else ' -'))
@@ -56,7 +71,5 @@ def diff(q2,q3,q4):
 def zips(filename):
     f = output(filename,'zips')
    
-    for taxonomy in parse(filename).findall('taxonomy'):
-        libelle = taxonomy.get('libelle')
-        zip = taxonomy.find('zip').text
+    for libelle, dtdeb, dtfin, zip in taxonomies(filename):
         f.write ('{:_<32} \t{}\n'.format(libelle, zip))
@@ -0,0 +1,12 @@
+from setuptools import setup, Extension
+
+setup(
+    name='nub',
+    version='4.2',
+    py_modules=['nub', 'dirdiff'],
+    ext_modules=[
+        Extension('_dirdiff_c', ['_dirdiff_c.c'],
+                  extra_compile_args=['-O3'],
+                  optional=True),
+    ],
+)